@@ -1,12 +1,30 @@
 # backend/app.py
+import os
+import math
 import sqlite3
 import threading
-from flask import Flask, jsonify, request
+import json
+from flask import Flask, Response, jsonify, make_response, request
 from flask_cors import CORS
 # --- Import our classes and config from the new logic file ---
 from train_logic import Simulation, init_db, DATABASE_FILE
 import ollama  # Needed for /api/explain
-from train_logic import LOOP_LINES  # ✅ add this at top with other imports
+from train_logic import TRAIN_FIELDS
+from shared_state import StateUnavailable
+from engine import EngineClient, EngineUnavailable
+
+# Optional fast encoders for /api/get_simulation_state; fall back to stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+COLUMNAR_MIMETYPE = "application/vnd.traincontrol.columnar+json"
 
 # Initialize Flask App
 app = Flask(__name__)
@@ -14,11 +32,120 @@ CORS(app)
 # This will hold our single simulation instance
 simulation = None
 
+# Multi-worker mode: the simulation runs in engine.py and this process only
+# reads its shared-memory snapshot and forwards commands to it.
+if os.environ.get("TRAIN_ENGINE"):
+    simulation = EngineClient()
+
+@app.errorhandler(EngineUnavailable)
+def engine_unavailable(e):
+    return jsonify({"success": False, "message": f"Simulation engine unavailable: {e}"}), 503
+
+
+def _reload_schedule():
+    # The schedule is already committed, so a missed reload is not a failed
+    # request: the simulation re-reads the schedule table on every tick anyway.
+    try:
+        simulation.reload_schedule()
+    except EngineUnavailable as e:
+        print(f"!!! Schedule saved but engine not notified: {e} !!!")
+
+
 # --- API Endpoints ---
 
+def _parse_float_arg(name):
+    raw = request.args.get(name)
+    if raw is None or raw == "":
+        return None
+    value = float(raw)
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be finite")
+    return value
+
+
+def _negotiate_mimetype():
+    """Pick the response type from the Accept header, or None if nothing we offer fits."""
+    if not request.accept_mimetypes:
+        return "application/json"   # no Accept header at all
+    # JSON is listed first so wildcard Accept headers (e.g. browsers' */*) stay JSON
+    offers = ["application/json", COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offers += MSGPACK_MIMETYPES
+    return request.accept_mimetypes.best_match(offers)
+
+
+def _to_columnar(state, fields):
+    """Turn a list of train dicts into one array per field."""
+    columns = list(fields) if fields else list(TRAIN_FIELDS)
+    return {
+        "simulation_time": state["simulation_time"],
+        "count": len(state["trains"]),
+        "columns": columns,
+        "data": {c: [t.get(c) for t in state["trains"]] for c in columns},
+    }
+
+
+def _encode_state(payload, mimetype):
+    """Serialize the state payload as the negotiated mimetype."""
+    if mimetype in MSGPACK_MIMETYPES:
+        return Response(msgpack.packb(payload, use_bin_type=True), mimetype="application/msgpack")
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, separators=(",", ":"))
+    return Response(body, mimetype=mimetype)
+
+
 @app.route('/api/get_simulation_state')
 def get_simulation_state():
-    return jsonify(simulation.get_simulation_state_for_api() if simulation else {"trains": [], "simulation_time": "00:00:00"})
+    # The body depends on Accept, so caches must key on it too
+    response = make_response(_simulation_state_response())
+    response.vary.add("Accept")
+    return response
+
+
+def _simulation_state_response():
+    # ?fields=id,position_km,status  -> project each train to these fields
+    # ?status=HALTED,ARRIVED         -> only trains in these statuses
+    # ?min_km=40&max_km=120          -> only trains within this position range
+    # Accept: application/msgpack    -> MessagePack body (406 if msgpack is not installed)
+    # Accept: application/vnd.traincontrol.columnar+json or ?layout=columnar -> one array per field
+    mimetype = _negotiate_mimetype()
+    if mimetype is None:
+        return jsonify({"success": False, "message": "Acceptable types: application/json, "
+                        f"{COLUMNAR_MIMETYPE}" + (", application/msgpack" if msgpack else "")}), 406
+    layout = request.args.get('layout')
+    if layout not in (None, 'columnar'):
+        return jsonify({"success": False, "message": f"Unknown layout: {layout}"}), 400
+
+    fields = None
+    if 'fields' in request.args:
+        fields = list(dict.fromkeys(f.strip() for f in request.args['fields'].split(',') if f.strip()))
+        if not fields:
+            return jsonify({"success": False, "message": "fields must name at least one field."}), 400
+        unknown = [f for f in fields if f not in TRAIN_FIELDS]
+        if unknown:
+            return jsonify({"success": False, "message": f"Unknown fields: {', '.join(unknown)}"}), 400
+    statuses = None
+    if request.args.get('status'):
+        statuses = {s.strip() for s in request.args['status'].split(',') if s.strip()}
+    try:
+        min_km = _parse_float_arg('min_km')
+        max_km = _parse_float_arg('max_km')
+    except ValueError:
+        return jsonify({"success": False, "message": "min_km/max_km must be finite numbers."}), 400
+
+    if simulation:
+        try:
+            state = simulation.get_simulation_state_for_api(fields, statuses, min_km, max_km)
+        except StateUnavailable as e:
+            return jsonify({"success": False, "message": f"Simulation state unavailable: {e}"}), 503
+    else:
+        state = {"trains": [], "simulation_time": "00:00:00"}
+
+    if layout == 'columnar' or mimetype == COLUMNAR_MIMETYPE:
+        state = _to_columnar(state, fields)
+    return _encode_state(state, mimetype)
 
 
 @app.route('/api/schedules', methods=['GET'])
@@ -61,97 +188,8 @@ def simulate_delay():
     if not simulation:
         return jsonify({"success": False, "message": "Simulation not running."}), 400
 
-    with simulation.lock:
-        train = simulation.trains.get(train_id)
-        if not train:
-            return jsonify({"success": False, "message": "Train not found."}), 404
-
-        # Find nearest loop line ahead of current position
-        nearest_loop = None
-        for name, pos in sorted(LOOP_LINES.items(), key=lambda x: x[1]):
-            if pos > train.position_km:
-                nearest_loop = pos
-                break
-
-        # helper to clear conflicts related to this train
-        def clear_conflicts_for(train_obj):
-            to_remove = [cid for cid in list(simulation.conflicts_handled)
-                         if cid.endswith(f"-{train_obj.id}") or cid.startswith(f"{train_obj.id}-")]
-            for cid in to_remove:
-                if cid in simulation.conflicts_handled:
-                    simulation.conflicts_handled.remove(cid)
-
-        # Log debug info about what was received
-        print(f"--- SIMULATE_DELAY called for train={train_id}, raw_delay={raw_delay}, {debug_note} ---")
-
-        # --- Branch: nearest loop found ---
-        if nearest_loop is not None:
-            # Order train to reach loop and halt
-            train.status = "EN_ROUTE_TO_LOOP"
-            train.maneuver_target_km = nearest_loop
-            train.speed_kmh = train.original_speed  # ensure it can travel to loop
-            simulation.log_decision(
-                f"DELAY INJECTED: Train {train.name} ordered to nearest loop at {nearest_loop:.1f} km for {delay_seconds//60} min. (raw={raw_delay})"
-            )
-            print(f"--- [DELAY INJECTED] {train.id} -> loop {nearest_loop:.1f} for {delay_seconds}s (raw={raw_delay}) ---")
-
-            def resume_train_at_loop():
-                with simulation.lock:
-                    print(f"--- [RESUME CALLBACK] triggered for train {train.id}; status currently={train.status} pos={train.position_km:.2f} ---")
-                    clear_conflicts_for(train)
-                    # If en-route and not exactly at loop, snap to loop so it doesn't get stuck on boundary
-                    try:
-                        if train.position_km < nearest_loop and train.status in ["EN_ROUTE_TO_LOOP", "HALTED_IN_LOOP"]:
-                            train.position_km = float(nearest_loop)
-                    except Exception:
-                        pass
-
-                    train.status = "ON_SCHEDULE"
-                    train.speed_kmh = train.original_speed
-                    train.maneuver_target_km = None
-                    train.halted_by = None
-                    train.time_in_adaptive_cruise = 0
-
-                    simulation.log_decision(f"Train {train.name} resumed after injected delay at loop {nearest_loop:.1f} km.")
-                    print(f"--- [RESUME] train {train.id} resumed after injected delay ---")
-
-            t = threading.Timer(delay_seconds, resume_train_at_loop)
-            t.daemon = True
-            t.start()
-
-            return jsonify({"success": True,
-                            "message": f"Train {train_id} delayed {delay_seconds//60} min at nearest loop ({nearest_loop:.1f} km).",
-                            "debug": debug_note})
-
-        else:
-            # No loop ahead -> halt in place
-            train.status = "HALTED"
-            train.speed_kmh = 0
-            train.halted_by = None
-            simulation.log_decision(
-                f"DELAY INJECTED: Train {train.name} halted in place for {delay_seconds//60} min (no loop ahead). (raw={raw_delay})"
-            )
-            print(f"--- [DELAY INJECTED] {train.id} halted in place for {delay_seconds}s (raw={raw_delay}) ---")
-
-            def resume_train_in_place():
-                with simulation.lock:
-                    print(f"--- [RESUME CALLBACK] triggered for train {train.id} (was halted in place); status now={train.status} pos={train.position_km:.2f} ---")
-                    clear_conflicts_for(train)
-                    train.status = "ON_SCHEDULE"
-                    train.speed_kmh = train.original_speed
-                    train.halted_by = None
-                    train.time_in_adaptive_cruise = 0
-                    train.maneuver_target_km = None
-                    simulation.log_decision(f"Train {train.name} resumed after injected in-place delay.")
-                    print(f"--- [RESUME] train {train.id} resumed after in-place delay ---")
-
-            t2 = threading.Timer(delay_seconds, resume_train_in_place)
-            t2.daemon = True
-            t2.start()
-
-            return jsonify({"success": True,
-                            "message": f"Train {train_id} delayed {delay_seconds//60} min (halted in place).",
-                            "debug": debug_note})
+    payload, status = simulation.inject_delay(train_id, delay_seconds, raw_delay, debug_note)
+    return jsonify(payload), status
 
 
 @app.route('/api/add_schedule', methods=['POST'])
@@ -163,11 +201,11 @@ def add_schedule():
                        (data['id'], data['name'], data['type'], data['priority'], data['speed'], data['departure_time_seconds'], data.get('start_station', 'MUMBAI CST'),
                         data.get('end_station', 'PUNE')))
         conn.commit(); conn.close()
-        if simulation:
-            simulation.schedule = simulation.load_schedule_from_db()
-        return jsonify({"success": True, "message": "Schedule added."}), 201
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
+    if simulation:
+        _reload_schedule()
+    return jsonify({"success": True, "message": "Schedule added."}), 201
 
 
 @app.route('/api/delete_schedule/<train_id>', methods=['DELETE'])
@@ -175,11 +213,11 @@ def delete_schedule(train_id):
     try:
         conn = sqlite3.connect(DATABASE_FILE); cursor = conn.cursor()
         cursor.execute("DELETE FROM schedules WHERE id = ?", (train_id,)); conn.commit(); conn.close()
-        if simulation:
-            simulation.schedule = simulation.load_schedule_from_db()
-        return jsonify({"success": True, "message": f"Schedule for train {train_id} deleted."})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
+    if simulation:
+        _reload_schedule()
+    return jsonify({"success": True, "message": f"Schedule for train {train_id} deleted."})
 
 
 @app.route('/api/register', methods=['POST'])
@@ -250,38 +288,11 @@ def respond_to_decision():
     train_id = data.get('train_id')
     decision = data.get('decision')
     
-    with simulation.lock:
-        train = simulation.trains.get(train_id)
-        if not train or not train.proposed_plan:
-            return jsonify({"success": False, "message": "Train or plan not found."}), 404
-
-        if decision == 'accept':
-            print(f"--- User ACCEPTED plan for {train.name}. Executing... ---")
-            simulation.log_decision(f"Controller ACCEPTED plan for {train.name}")
-            plan = train.proposed_plan
-            action = plan.get("action")
-            
-            train.halted_by = plan.get("caused_by")
-
-            if action == "MOVE_TO_LOOP_AND_HALT":
-                train.status = "EN_ROUTE_TO_LOOP"
-                train.maneuver_target_km = plan.get("location_km")
-            elif action == "HALT":
-                train.status = "HALTED"
-                train.speed_kmh = 0
-        
-        elif decision == 'reject':
-            print(f"--- User REJECTED plan for {train.name}. Resuming normal operation. ---")
-            simulation.log_decision(f"Controller REJECTED plan for {train.name}")
-            train.status = "ON_SCHEDULE"
-            if train.halted_by:
-                conflict_id = f"{train.halted_by}-{train.id}"
-                if conflict_id in simulation.conflicts_handled:
-                    simulation.conflicts_handled.remove(conflict_id)
-                train.halted_by = None
-        
-        train.proposed_plan = None
-    return jsonify({"success": True})
+    if not simulation:
+        return jsonify({"success": False, "message": "Simulation not running."}), 400
+
+    payload, status = simulation.respond_to_decision(train_id, decision)
+    return jsonify(payload), status
 
 
 @app.route('/api/decision_history', methods=['GET'])
@@ -320,10 +331,12 @@ def get_user_profile(username):
 
 
 if __name__ == '__main__':
-    init_db()
-    simulation = Simulation()
-    simulation_thread = threading.Thread(target=simulation.update, daemon=True)
-    simulation_thread.start()
+    # With TRAIN_ENGINE set, engine.py owns the simulation; don't start a second one here
+    if not os.environ.get("TRAIN_ENGINE"):
+        init_db()
+        simulation = Simulation()
+        simulation_thread = threading.Thread(target=simulation.update, daemon=True)
+        simulation_thread.start()
     app.run(port=5001, debug=True, use_reloader=False)
     # Run once in backend (e.g., add to init_db() or run manually)
 def migrate_add_start_end_columns():
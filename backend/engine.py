@@ -0,0 +1,137 @@
+# backend/engine.py
+#
+# Runs the simulation as its own process so the API can be served by several
+# worker processes:
+#
+#   export TRAIN_ENGINE_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+#   python engine.py                         # simulation + shared-memory publisher
+#   TRAIN_ENGINE=1 gunicorn -w 4 -b 127.0.0.1:5001 app:app
+#
+# Train state is published to shared memory (see shared_state.py) after every
+# tick and every command; control commands from the workers come back over a
+# local multiprocessing.connection socket. That socket unpickles what it
+# receives, so both sides must share TRAIN_ENGINE_AUTHKEY; there is no default.
+
+import os
+import signal
+import sys
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from train_logic import Simulation, init_db
+from shared_state import SHM_NAME, StateReader, StateWriter
+
+ENGINE_ADDRESS = ("127.0.0.1", int(os.environ.get("TRAIN_ENGINE_PORT", 5002)))
+
+
+class EngineUnavailable(Exception):
+    """A command could not be delivered to the engine, or the engine failed to run it."""
+
+
+def engine_authkey():
+    key = os.environ.get("TRAIN_ENGINE_AUTHKEY")
+    if not key:
+        raise RuntimeError("TRAIN_ENGINE_AUTHKEY must be set (a long random secret shared by engine and workers).")
+    return key.encode()
+
+
+# Commands the workers may send, mapped to Simulation methods
+COMMANDS = {"inject_delay", "respond_to_decision", "reload_schedule", "get_decision_history"}
+
+
+def handle_connection(conn, simulation):
+    try:
+        while True:
+            try:
+                command, args = conn.recv()
+            except EOFError:
+                return
+            if command not in COMMANDS:
+                conn.send(("error", f"Unknown command: {command}"))
+                continue
+            try:
+                conn.send(("ok", getattr(simulation, command)(*args)))
+            except Exception as e:
+                conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def serve(shm_name=SHM_NAME):
+    authkey = engine_authkey()
+    # Bind the command socket before touching shared memory: it doubles as the
+    # single-instance lock, so a second engine stops here instead of retiring
+    # the running engine's segment.
+    try:
+        listener = Listener(ENGINE_ADDRESS, authkey=authkey)
+    except OSError as e:
+        raise SystemExit(f"!!! Cannot listen on {ENGINE_ADDRESS[0]}:{ENGINE_ADDRESS[1]} ({e}); "
+                         "is another engine already running? !!!")
+
+    try:
+        init_db()
+        simulation = Simulation()
+        writer = StateWriter(name=shm_name, capacity=len(simulation.schedule))
+        try:
+            # Without this, SIGTERM (kill, docker stop, systemd) skips the finally
+            # below and workers keep reading the segment until it goes stale.
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+            simulation.on_state_change = writer.publish
+            with simulation.lock:
+                writer.publish(simulation)
+
+            simulation_thread = threading.Thread(target=simulation.update, daemon=True)
+            simulation_thread.start()
+
+            print(f"--- Engine publishing state to shared memory, commands on {ENGINE_ADDRESS[0]}:{ENGINE_ADDRESS[1]} ---")
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=handle_connection, args=(conn, simulation), daemon=True).start()
+        finally:
+            with simulation.lock:
+                simulation.on_state_change = None
+                writer.close()
+    finally:
+        listener.close()
+
+
+class EngineClient:
+    """Stands in for Simulation inside an API worker: reads come from shared
+    memory, everything that changes state is forwarded to the engine."""
+
+    def __init__(self):
+        self.authkey = engine_authkey()
+        self.reader = StateReader()
+
+    def _call(self, command, *args):
+        try:
+            with Client(ENGINE_ADDRESS, authkey=self.authkey) as conn:
+                conn.send((command, args))
+                kind, result = conn.recv()
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise EngineUnavailable(f"engine at {ENGINE_ADDRESS[0]}:{ENGINE_ADDRESS[1]} unreachable: {e}") from e
+        if kind == "error":
+            raise EngineUnavailable(f"engine failed to run {command}: {result}")
+        return result
+
+    def get_simulation_state_for_api(self, fields=None, statuses=None, min_km=None, max_km=None):
+        return self.reader.get_simulation_state_for_api(fields, statuses, min_km, max_km)
+
+    def get_decision_history(self):
+        return self._call("get_decision_history")
+
+    def inject_delay(self, train_id, delay_seconds, raw_delay=None, debug_note=None):
+        return self._call("inject_delay", train_id, delay_seconds, raw_delay, debug_note)
+
+    def respond_to_decision(self, train_id, decision):
+        return self._call("respond_to_decision", train_id, decision)
+
+    def reload_schedule(self):
+        return self._call("reload_schedule")
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,219 @@
+# backend/shared_state.py
+#
+# Shared-memory snapshot of the simulation, written by the engine process
+# (engine.py) and read lock-free by any number of API worker processes.
+#
+# Layout:
+#   header  (64 bytes): see HEADER below
+#   records (capacity x RECORD.size): fixed-layout, one per train
+#   heap    (heap_size bytes): per-train JSON for every field except
+#           position_km, addressed by the (offset, length) in its record
+#
+# Position stays in the fixed record so range filters never decode JSON;
+# strings and the proposed plan live in the heap so nothing is truncated.
+#
+# `seq` works as a seqlock: the writer makes it odd before touching the region
+# and even again once done. A reader copies the region and only accepts the
+# copy if `seq` was even and unchanged across the copy, otherwise it retries
+# until READ_TIMEOUT_SECONDS runs out.
+#
+# The writer never reuses a segment after unlinking it. When it needs a bigger
+# one, or when a new engine replaces an old one, the old header is marked
+# retired first, so readers still mapped to it reattach by name. An engine
+# that dies without retiring its segment stops bumping `published_at`, and
+# readers refuse snapshots older than STALE_AFTER_SECONDS.
+
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+
+from train_logic import Train
+
+SHM_NAME = "train_control_state"
+MIN_CAPACITY = 256
+HEAP_BYTES_PER_TRAIN = 1024
+READ_TIMEOUT_SECONDS = 0.5
+STALE_AFTER_SECONDS = 5.0   # the engine publishes at least once per 1s tick
+
+# seq, sim_time_seconds, count, capacity, heap_size, retired,
+# published_at (time.monotonic(), which is system-wide on Linux)
+HEADER = struct.Struct("<QQIIIId")
+HEADER_SIZE = 64
+SEQ = struct.Struct("<Q")
+RETIRED = struct.Struct("<I")
+RETIRED_OFFSET = 28
+RECORD = struct.Struct(
+    "<d"     # position_km
+    "I"      # heap offset of this train's JSON
+    "I"      # length of this train's JSON
+)
+HEAP_FIELDS = (
+    "id", "name", "type", "priority", "speed_kmh", "original_speed", "status",
+    "maneuver_target_km", "halted_by", "proposed_plan", "start_station", "end_station",
+)
+
+
+class StateUnavailable(Exception):
+    """No consistent snapshot could be read (engine not running or stuck mid-write)."""
+
+
+def _region_size(capacity, heap_size):
+    return HEADER_SIZE + capacity * RECORD.size + heap_size
+
+
+def _retire(shm):
+    RETIRED.pack_into(shm.buf, RETIRED_OFFSET, 1)
+
+
+class StateWriter:
+    """Owned by the engine process; publishes the trains after every change."""
+
+    def __init__(self, name=SHM_NAME, capacity=MIN_CAPACITY):
+        self.name = name
+        self.seq = 0
+        self.shm = None
+        try:
+            # A previous engine may have left its segment behind; retire it so
+            # workers still attached to it move over to ours.
+            stale = shared_memory.SharedMemory(name=name)
+            if stale.size >= HEADER_SIZE:
+                _retire(stale)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self._allocate(max(capacity, MIN_CAPACITY), max(capacity, MIN_CAPACITY) * HEAP_BYTES_PER_TRAIN)
+
+    def _allocate(self, capacity, heap_size):
+        if self.shm is not None:
+            _retire(self.shm)
+            self.shm.close()
+            self.shm.unlink()
+        self.capacity = capacity
+        self.heap_size = heap_size
+        size = _region_size(capacity, heap_size)
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        # Odd seq keeps readers waiting until the first publish fills the segment
+        HEADER.pack_into(self.shm.buf, 0, self.seq + 1, 0, 0, capacity, heap_size, 0, time.monotonic())
+
+    def publish(self, simulation):
+        """Copy the simulation into shared memory. Call with simulation.lock held."""
+        trains = list(simulation.trains.values())
+        blobs = [
+            json.dumps({f: getattr(train, f, None) for f in HEAP_FIELDS}, separators=(",", ":")).encode("utf-8")
+            for train in trains
+        ]
+        heap_needed = sum(len(b) for b in blobs)
+        if len(trains) > self.capacity or heap_needed > self.heap_size:
+            capacity = max(self.capacity, len(trains) * 2)
+            heap_size = max(capacity * HEAP_BYTES_PER_TRAIN, heap_needed * 2)
+            print(f"--- Shared state region too small for {len(trains)} trains ({heap_needed} heap bytes); "
+                  f"growing to {capacity} trains / {heap_size} heap bytes ---")
+            self._allocate(capacity, heap_size)
+
+        buf = self.shm.buf
+        heap_start = HEADER_SIZE + self.capacity * RECORD.size
+        self.seq += 1
+        SEQ.pack_into(buf, 0, self.seq)   # odd: write in progress
+        offset = HEADER_SIZE
+        heap_offset = 0
+        for train, blob in zip(trains, blobs):
+            RECORD.pack_into(buf, offset, float(train.position_km), heap_offset, len(blob))
+            buf[heap_start + heap_offset:heap_start + heap_offset + len(blob)] = blob
+            offset += RECORD.size
+            heap_offset += len(blob)
+        # Keep the retired flag: once another engine has taken the name over, this segment stays retired
+        retired = RETIRED.unpack_from(buf, RETIRED_OFFSET)[0]
+        HEADER.pack_into(buf, 0, self.seq, int(simulation.simulation_time_seconds), len(trains),
+                         self.capacity, self.heap_size, retired, time.monotonic())
+        self.seq += 1
+        SEQ.pack_into(buf, 0, self.seq)   # even: snapshot consistent
+
+    def close(self):
+        _retire(self.shm)
+        self.shm.close()
+        self.shm.unlink()
+
+
+class StateReader:
+    """Used by API workers; reads the latest consistent snapshot without locking."""
+
+    def __init__(self, name=SHM_NAME, timeout=READ_TIMEOUT_SECONDS, stale_after=STALE_AFTER_SECONDS):
+        self.name = name
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.shm = None
+
+    def _attach(self):
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.name, track=False)
+        except TypeError:
+            # Python < 3.13 has no `track`; stop the resource tracker from
+            # unlinking the engine's segment when this worker exits.
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    def _snapshot(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if time.monotonic() > deadline:
+                raise StateUnavailable(f"no consistent snapshot in shared memory '{self.name}' "
+                                       f"within {self.timeout}s")
+            if self.shm is None:
+                try:
+                    self._attach()
+                except FileNotFoundError:
+                    time.sleep(0.001)
+                    continue
+            buf = self.shm.buf
+            seq_before, sim_time, count, capacity, heap_size, retired, published_at = HEADER.unpack_from(buf, 0)
+            if retired:
+                self.close()
+                continue
+            if seq_before % 2 or not capacity:   # mid-write, or header not yet written
+                time.sleep(0)
+                continue
+            age = time.monotonic() - published_at
+            if age > self.stale_after:
+                # The engine died without retiring the segment; drop it so a new engine is picked up
+                self.close()
+                raise StateUnavailable(f"last snapshot in shared memory '{self.name}' is {age:.1f}s old; "
+                                       "is the engine running?")
+            heap_start = HEADER_SIZE + capacity * RECORD.size
+            records = bytes(buf[HEADER_SIZE:HEADER_SIZE + count * RECORD.size])
+            # Blobs are laid out back to back, so the last record marks the end of the heap in use
+            heap_used = sum(RECORD.unpack_from(records, len(records) - RECORD.size)[1:]) if count else 0
+            heap = bytes(buf[heap_start:heap_start + min(heap_used, heap_size)])
+            if SEQ.unpack_from(buf, 0)[0] == seq_before:
+                return sim_time, records, heap
+
+    def get_simulation_state_for_api(self, fields=None, statuses=None, min_km=None, max_km=None):
+        """Same contract as Simulation.get_simulation_state_for_api."""
+        sim_time, records, heap = self._snapshot()
+        trains = []
+        for position, heap_offset, length in RECORD.iter_unpack(records):
+            if min_km is not None and position < min_km:
+                continue
+            if max_km is not None and position > max_km:
+                continue
+            data = json.loads(heap[heap_offset:heap_offset + length])
+            if statuses and data["status"] not in statuses:
+                continue
+            train = Train(data["id"], data["name"], data["type"], data["priority"], data["speed_kmh"], position)
+            for f in HEAP_FIELDS:
+                setattr(train, f, data[f])
+            trains.append(train.to_dict(fields))
+
+        mins, secs = divmod(int(sim_time), 60)
+        hours, mins = divmod(mins, 60)
+        return {
+            "simulation_time": f"{hours:02d}:{mins:02d}:{secs:02d}",
+            "trains": trains
+        }
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
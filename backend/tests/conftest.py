@@ -0,0 +1,40 @@
+import os
+import socket
+import sys
+import threading
+import uuid
+
+import pytest
+
+# The backend modules import each other by bare name (e.g. `from train_logic import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from train_logic import Simulation  # noqa: E402
+
+
+@pytest.fixture
+def make_simulation():
+    """Build a Simulation holding the given trains, without touching the database."""
+    def make(trains, simulation_time_seconds=3600):
+        simulation = Simulation.__new__(Simulation)
+        simulation.lock = threading.Lock()
+        simulation.trains = {t.id: t for t in trains}
+        simulation.simulation_time_seconds = simulation_time_seconds
+        simulation.on_state_change = None
+        return simulation
+    return make
+
+
+@pytest.fixture
+def free_address():
+    """A local TCP address nothing is listening on."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    address = sock.getsockname()
+    sock.close()
+    return address
+
+
+@pytest.fixture
+def shm_name():
+    return f"train_control_test_{uuid.uuid4().hex[:12]}"
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+import app as app_module
+import engine
+from train_logic import Train, init_db
+
+
+@pytest.fixture
+def client(monkeypatch, make_simulation):
+    express = Train("T1", "Deccan Queen", "EXP", 1, 100, 20)
+    local = Train("T2", "Karjat Local", "EMU", 3, 60, 120)
+    local.status = "HALTED"
+    monkeypatch.setattr(app_module, "simulation", make_simulation([express, local]))
+    return app_module.app.test_client()
+
+
+def get_state(client, query="", accept=None):
+    headers = {"Accept": accept} if accept else {}
+    return client.get(f"/api/get_simulation_state{query}", headers=headers)
+
+
+def test_full_state_by_default(client):
+    resp = get_state(client)
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/json"
+    assert "Accept" in resp.vary
+    trains = resp.get_json()["trains"]
+    assert [t["id"] for t in trains] == ["T1", "T2"]
+    assert trains[0]["upcoming_stations"][0]["name"] == "THANE"
+
+
+def test_projection_and_filters(client):
+    resp = get_state(client, "?fields=id,status,id&status=HALTED")
+    assert resp.get_json()["trains"] == [{"id": "T2", "status": "HALTED"}]
+    resp = get_state(client, "?fields=id&min_km=10&max_km=50")
+    assert resp.get_json()["trains"] == [{"id": "T1"}]
+
+
+@pytest.mark.parametrize("query", [
+    "?fields=", "?fields=,", "?fields=id,bogus",
+    "?min_km=abc", "?max_km=nan", "?min_km=inf",
+    "?layout=rows",
+])
+def test_bad_queries_are_rejected(client, query):
+    resp = get_state(client, query)
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
+    assert "Accept" in resp.vary
+
+
+def test_columnar_via_query(client):
+    resp = get_state(client, "?fields=id,id,position_km&layout=columnar")
+    assert resp.mimetype == "application/json"
+    body = resp.get_json()
+    assert body["columns"] == ["id", "position_km"]
+    assert body["data"] == {"id": ["T1", "T2"], "position_km": [20.0, 120.0]}
+
+
+def test_columnar_via_accept(client):
+    resp = get_state(client, "?fields=id", accept=app_module.COLUMNAR_MIMETYPE)
+    assert resp.mimetype == app_module.COLUMNAR_MIMETYPE
+    assert json.loads(resp.data)["data"] == {"id": ["T1", "T2"]}
+
+
+def test_wildcard_accept_stays_json(client):
+    resp = get_state(client, "?fields=id", accept="text/html,*/*;q=0.1")
+    assert resp.mimetype == "application/json"
+
+
+def test_msgpack_when_installed(client):
+    msgpack = pytest.importorskip("msgpack")
+    resp = get_state(client, "?fields=id", accept="application/msgpack")
+    assert resp.mimetype == "application/msgpack"
+    assert msgpack.unpackb(resp.data)["trains"] == [{"id": "T1"}, {"id": "T2"}]
+
+
+def test_msgpack_without_library_is_not_acceptable(client, monkeypatch):
+    monkeypatch.setattr(app_module, "msgpack", None)
+    resp = get_state(client, accept="application/msgpack")
+    assert resp.status_code == 406
+    assert "Accept" in resp.vary
+
+
+@pytest.fixture
+def engine_down_client(monkeypatch, tmp_path, free_address):
+    monkeypatch.chdir(tmp_path)   # DATABASE_FILE is relative to the working directory
+    init_db()
+    monkeypatch.setenv("TRAIN_ENGINE_AUTHKEY", "test-key")
+    monkeypatch.setattr(engine, "ENGINE_ADDRESS", free_address)
+    monkeypatch.setattr(app_module, "simulation", engine.EngineClient())
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize("method,path,body", [
+    ("post", "/api/simulate_delay", {"train_id": "T1", "delay": 5}),
+    ("post", "/api/respond_to_decision", {"train_id": "T1", "decision": "accept"}),
+    ("get", "/api/decision_history", None),
+])
+def test_commands_return_503_while_engine_down(engine_down_client, method, path, body):
+    resp = getattr(engine_down_client, method)(path, json=body)
+    assert resp.status_code == 503
+    assert resp.get_json()["success"] is False
+
+
+def test_schedule_change_succeeds_while_engine_down(engine_down_client):
+    resp = engine_down_client.post("/api/add_schedule", json={
+        "id": "T9", "name": "Sinhagad", "type": "EXP", "priority": 2, "speed": 90, "departure_time_seconds": 0,
+    })
+    assert resp.status_code == 201
+    assert [s["id"] for s in engine_down_client.get("/api/schedules").get_json()] == ["T9"]
+    assert engine_down_client.delete("/api/delete_schedule/T9").status_code == 200
@@ -0,0 +1,125 @@
+from multiprocessing import Pipe
+from multiprocessing.connection import Listener
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import engine
+from shared_state import RETIRED, RETIRED_OFFSET, StateReader, StateUnavailable, StateWriter
+from train_logic import Train
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeSimulation:
+    def respond_to_decision(self, train_id, decision):
+        return {"success": True, "train_id": train_id, "decision": decision}, 200
+
+    def get_decision_history(self):
+        raise ValueError("history unavailable")
+
+
+@pytest.fixture
+def engine_env(monkeypatch, free_address):
+    monkeypatch.setenv("TRAIN_ENGINE_AUTHKEY", "test-key")
+    monkeypatch.setattr(engine, "ENGINE_ADDRESS", free_address)
+    return free_address
+
+
+def test_handle_connection_dispatches_commands():
+    client, server = Pipe()
+    worker = threading.Thread(target=engine.handle_connection, args=(server, FakeSimulation()))
+    worker.start()
+
+    client.send(("respond_to_decision", ("T1", "accept")))
+    assert client.recv() == ("ok", ({"success": True, "train_id": "T1", "decision": "accept"}, 200))
+
+    client.send(("get_decision_history", ()))
+    assert client.recv() == ("error", "history unavailable")
+
+    client.send(("__class__", ()))
+    assert client.recv() == ("error", "Unknown command: __class__")
+
+    client.close()
+    worker.join(timeout=1)
+    assert not worker.is_alive()
+
+
+def test_authkey_is_required(monkeypatch):
+    monkeypatch.delenv("TRAIN_ENGINE_AUTHKEY", raising=False)
+    with pytest.raises(RuntimeError):
+        engine.engine_authkey()
+    with pytest.raises(RuntimeError):
+        engine.EngineClient()
+
+
+def test_client_round_trip_over_socket(engine_env):
+    listener = Listener(engine_env, authkey=b"test-key")
+
+    def accept_one():
+        engine.handle_connection(listener.accept(), FakeSimulation())
+    for _ in range(2):
+        threading.Thread(target=accept_one, daemon=True).start()
+    try:
+        client = engine.EngineClient()
+        assert client.respond_to_decision("T1", "reject") == \
+            ({"success": True, "train_id": "T1", "decision": "reject"}, 200)
+        with pytest.raises(engine.EngineUnavailable, match="history unavailable"):
+            client.get_decision_history()
+    finally:
+        listener.close()
+
+
+def test_commands_while_engine_down(engine_env):
+    client = engine.EngineClient()
+    with pytest.raises(engine.EngineUnavailable):
+        client.inject_delay("T1", 60)
+    with pytest.raises(engine.EngineUnavailable):
+        client.reload_schedule()
+
+
+def test_second_engine_leaves_live_one_alone(engine_env, shm_name, make_simulation):
+    live_listener = Listener(engine_env, authkey=b"test-key")   # the running engine
+    live_writer = StateWriter(name=shm_name)
+    reader = StateReader(name=shm_name)
+    try:
+        live_writer.publish(make_simulation([Train("T1", "Deccan", "EXP", 1, 100, 10)]))
+        with pytest.raises(SystemExit):
+            engine.serve(shm_name)
+        assert RETIRED.unpack_from(live_writer.shm.buf, RETIRED_OFFSET)[0] == 0
+        live_writer.publish(make_simulation([Train("T1", "Deccan", "EXP", 1, 100, 12)]))
+        assert reader.get_simulation_state_for_api(["position_km"])["trains"] == [{"position_km": 12.0}]
+    finally:
+        reader.close()
+        live_writer.close()
+        live_listener.close()
+
+
+def test_sigterm_retires_segment(tmp_path, free_address, shm_name):
+    env = dict(os.environ, TRAIN_ENGINE_AUTHKEY="test-key", TRAIN_ENGINE_PORT=str(free_address[1]),
+               PYTHONPATH=BACKEND_DIR)
+    proc = subprocess.Popen([sys.executable, "-c", f"import engine; engine.serve({shm_name!r})"],
+                            cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    reader = StateReader(name=shm_name)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                reader.get_simulation_state_for_api()
+                break
+            except StateUnavailable:
+                assert time.monotonic() < deadline, proc.stderr.read() if proc.poll() is not None else "engine never published"
+
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(timeout=10) == 0
+        with pytest.raises(StateUnavailable):
+            reader.get_simulation_state_for_api()
+    finally:
+        reader.close()
+        if proc.poll() is None:
+            proc.kill()
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from shared_state import RETIRED, RETIRED_OFFSET, SEQ, StateReader, StateUnavailable, StateWriter, _retire
+from train_logic import Train
+
+
+def long_train():
+    train = Train("12951-rajdhani-express", "Mumbai Rajdhani Express — पश्चिम", "RAJDHANI", 1, 130, 42.5)
+    train.status = "AWAITING_DECISION"
+    train.halted_by = "12009-shatabdi-express-special"
+    train.end_station = "PUNE"
+    train.proposed_plan = {
+        "action": "MOVE_TO_LOOP_AND_HALT",
+        "train_id": train.id,
+        "location_km": 85.5,
+        "caused_by": train.halted_by,
+        "reason": "x" * 500,
+    }
+    return train
+
+
+def test_round_trip_matches_single_process_output(shm_name, make_simulation):
+    simulation = make_simulation([long_train(), Train("T2", "Local", "EMU", 3, 80, 10)])
+    writer = StateWriter(name=shm_name)
+    reader = StateReader(name=shm_name)
+    try:
+        writer.publish(simulation)
+        assert reader.get_simulation_state_for_api() == simulation.get_simulation_state_for_api()
+        assert reader.get_simulation_state_for_api(["id", "speed_kmh"], {"AWAITING_DECISION"}, 40, 50) == \
+            simulation.get_simulation_state_for_api(["id", "speed_kmh"], {"AWAITING_DECISION"}, 40, 50)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_region_grows_past_capacity(shm_name, make_simulation):
+    trains = [Train(f"T{i}", f"Train {i}", "EXP", 1, 100, i) for i in range(300)]
+    simulation = make_simulation(trains)
+    writer = StateWriter(name=shm_name, capacity=1)
+    reader = StateReader(name=shm_name)
+    try:
+        writer.publish(make_simulation(trains[:1]))
+        assert len(reader.get_simulation_state_for_api()["trains"]) == 1
+        writer.publish(simulation)
+        assert [t["id"] for t in reader.get_simulation_state_for_api(["id"])["trains"]] == [t.id for t in trains]
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_follows_engine_restart(shm_name, make_simulation):
+    train = Train("T1", "Deccan", "EXP", 1, 100, 10)
+    writer = StateWriter(name=shm_name)
+    reader = StateReader(name=shm_name)
+    try:
+        writer.publish(make_simulation([train]))
+        assert reader.get_simulation_state_for_api(["position_km"])["trains"] == [{"position_km": 10.0}]
+
+        writer.close()
+        train.position_km = 55.0
+        writer = StateWriter(name=shm_name)
+        writer.publish(make_simulation([train]))
+        assert reader.get_simulation_state_for_api(["position_km"])["trains"] == [{"position_km": 55.0}]
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_retries_while_write_in_progress(shm_name, make_simulation):
+    writer = StateWriter(name=shm_name)
+    reader = StateReader(name=shm_name, timeout=2)
+    try:
+        writer.publish(make_simulation([Train("T1", "Deccan", "EXP", 1, 100, 10)]))
+        SEQ.pack_into(writer.shm.buf, 0, writer.seq + 1)   # torn: writer stopped mid-publish
+
+        def finish_write():
+            time.sleep(0.05)
+            writer.publish(make_simulation([Train("T1", "Deccan", "EXP", 1, 100, 20)]))
+        finisher = threading.Thread(target=finish_write)
+        finisher.start()
+        state = reader.get_simulation_state_for_api(["position_km"])
+        finisher.join()
+        assert state["trains"] == [{"position_km": 20.0}]
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_gives_up_on_stuck_writer(shm_name, make_simulation):
+    writer = StateWriter(name=shm_name)
+    reader = StateReader(name=shm_name, timeout=0.05)
+    try:
+        writer.publish(make_simulation([]))
+        SEQ.pack_into(writer.shm.buf, 0, writer.seq + 1)   # engine died mid-publish
+        with pytest.raises(StateUnavailable):
+            reader.get_simulation_state_for_api()
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_without_engine_is_unavailable(shm_name, make_simulation):
+    with pytest.raises(StateUnavailable):
+        StateReader(name=shm_name, timeout=0.01).get_simulation_state_for_api()
+
+
+def test_snapshot_goes_stale_when_engine_dies(shm_name, make_simulation):
+    writer = StateWriter(name=shm_name)
+    reader = StateReader(name=shm_name, stale_after=0.1)
+    try:
+        writer.publish(make_simulation([Train("T1", "Deccan", "EXP", 1, 100, 10)]))
+        assert len(reader.get_simulation_state_for_api()["trains"]) == 1
+        time.sleep(0.2)   # engine killed: no close(), no more publishes
+        with pytest.raises(StateUnavailable):
+            reader.get_simulation_state_for_api()
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_publish_keeps_retired_flag(shm_name, make_simulation):
+    writer = StateWriter(name=shm_name)
+    try:
+        _retire(writer.shm)   # another engine took the name over
+        writer.publish(make_simulation([]))
+        assert RETIRED.unpack_from(writer.shm.buf, RETIRED_OFFSET)[0] == 1
+    finally:
+        writer.close()
@@ -18,6 +18,12 @@ LOOP_LINES = {
     "Thane": STATIONS[1]["pos_km"], "Kalyan": STATIONS[2]["pos_km"],
     "Karjat": STATIONS[3]["pos_km"], "Lonavala": STATIONS[4]["pos_km"],
 }
+TRAIN_FIELDS = (
+    "id", "name", "type", "priority", "speed_kmh", "position_km", "status",
+    "maneuver_target_km", "halted_by", "proposed_plan", "upcoming_stations",
+    "next_station", "eta_next_station", "start_station", "end_station",
+)
+UPCOMING_FIELDS = frozenset({"upcoming_stations", "next_station", "eta_next_station"})
 
 def init_db():
     conn = sqlite3.connect(DATABASE_FILE)
@@ -103,9 +109,11 @@ class Train:
                 })
         return upcoming
 
-    def to_dict(self):
-        upcoming = self.get_upcoming_stations()
-        return {
+    def to_dict(self, fields=None):
+        # Only compute upcoming stations when a requested field needs them
+        needs_upcoming = fields is None or not UPCOMING_FIELDS.isdisjoint(fields)
+        upcoming = self.get_upcoming_stations() if needs_upcoming else []
+        data = {
             "id": self.id,
             "name": self.name,
             "type": self.type,
@@ -122,6 +130,9 @@ class Train:
             "start_station": getattr(self, "start_station", None),
             "end_station": getattr(self, "end_station", None)
         }
+        if fields is None:
+            return data
+        return {f: data[f] for f in fields if f in data}
 
 
 class Simulation:
@@ -134,6 +145,7 @@ class Simulation:
         self.spawned_train_ids = set()
         self.conflicts_handled = set()
         self.decision_history = []   # store human/AI decisions and important events
+        self.on_state_change = None  # optional callback(sim), run under the lock after each tick or command
 
     def log_decision(self, message):
         """Record a timestamped message in the decision history and print it."""
@@ -148,6 +160,149 @@ class Simulation:
         with self.lock:
             return list(self.decision_history)
 
+    def publish_state(self):
+        """Hand the current state to on_state_change. Call with self.lock held."""
+        if self.on_state_change:
+            self.on_state_change(self)
+
+    def reload_schedule(self):
+        self.schedule = self.load_schedule_from_db()
+
+    def _clear_conflicts_for(self, train):
+        to_remove = [cid for cid in list(self.conflicts_handled)
+                     if cid.endswith(f"-{train.id}") or cid.startswith(f"{train.id}-")]
+        for cid in to_remove:
+            if cid in self.conflicts_handled:
+                self.conflicts_handled.remove(cid)
+
+    def inject_delay(self, train_id, delay_seconds, raw_delay=None, debug_note=None):
+        """Send a train to the nearest loop ahead (or halt it in place) for
+        `delay_seconds`. Returns (payload, http_status)."""
+        with self.lock:
+            train = self.trains.get(train_id)
+            if not train:
+                return {"success": False, "message": "Train not found."}, 404
+
+            # Find nearest loop line ahead of current position
+            nearest_loop = None
+            for name, pos in sorted(LOOP_LINES.items(), key=lambda x: x[1]):
+                if pos > train.position_km:
+                    nearest_loop = pos
+                    break
+
+            # Log debug info about what was received
+            print(f"--- SIMULATE_DELAY called for train={train_id}, raw_delay={raw_delay}, {debug_note} ---")
+
+            # --- Branch: nearest loop found ---
+            if nearest_loop is not None:
+                # Order train to reach loop and halt
+                train.status = "EN_ROUTE_TO_LOOP"
+                train.maneuver_target_km = nearest_loop
+                train.speed_kmh = train.original_speed  # ensure it can travel to loop
+                self.log_decision(
+                    f"DELAY INJECTED: Train {train.name} ordered to nearest loop at {nearest_loop:.1f} km for {delay_seconds//60} min. (raw={raw_delay})"
+                )
+                print(f"--- [DELAY INJECTED] {train.id} -> loop {nearest_loop:.1f} for {delay_seconds}s (raw={raw_delay}) ---")
+
+                def resume_train_at_loop():
+                    with self.lock:
+                        print(f"--- [RESUME CALLBACK] triggered for train {train.id}; status currently={train.status} pos={train.position_km:.2f} ---")
+                        self._clear_conflicts_for(train)
+                        # If en-route and not exactly at loop, snap to loop so it doesn't get stuck on boundary
+                        try:
+                            if train.position_km < nearest_loop and train.status in ["EN_ROUTE_TO_LOOP", "HALTED_IN_LOOP"]:
+                                train.position_km = float(nearest_loop)
+                        except Exception:
+                            pass
+
+                        train.status = "ON_SCHEDULE"
+                        train.speed_kmh = train.original_speed
+                        train.maneuver_target_km = None
+                        train.halted_by = None
+                        train.time_in_adaptive_cruise = 0
+
+                        self.log_decision(f"Train {train.name} resumed after injected delay at loop {nearest_loop:.1f} km.")
+                        print(f"--- [RESUME] train {train.id} resumed after injected delay ---")
+                        self.publish_state()
+
+                t = threading.Timer(delay_seconds, resume_train_at_loop)
+                t.daemon = True
+                t.start()
+                self.publish_state()
+
+                return {"success": True,
+                        "message": f"Train {train_id} delayed {delay_seconds//60} min at nearest loop ({nearest_loop:.1f} km).",
+                        "debug": debug_note}, 200
+
+            else:
+                # No loop ahead -> halt in place
+                train.status = "HALTED"
+                train.speed_kmh = 0
+                train.halted_by = None
+                self.log_decision(
+                    f"DELAY INJECTED: Train {train.name} halted in place for {delay_seconds//60} min (no loop ahead). (raw={raw_delay})"
+                )
+                print(f"--- [DELAY INJECTED] {train.id} halted in place for {delay_seconds}s (raw={raw_delay}) ---")
+
+                def resume_train_in_place():
+                    with self.lock:
+                        print(f"--- [RESUME CALLBACK] triggered for train {train.id} (was halted in place); status now={train.status} pos={train.position_km:.2f} ---")
+                        self._clear_conflicts_for(train)
+                        train.status = "ON_SCHEDULE"
+                        train.speed_kmh = train.original_speed
+                        train.halted_by = None
+                        train.time_in_adaptive_cruise = 0
+                        train.maneuver_target_km = None
+                        self.log_decision(f"Train {train.name} resumed after injected in-place delay.")
+                        print(f"--- [RESUME] train {train.id} resumed after in-place delay ---")
+                        self.publish_state()
+
+                t2 = threading.Timer(delay_seconds, resume_train_in_place)
+                t2.daemon = True
+                t2.start()
+                self.publish_state()
+
+                return {"success": True,
+                        "message": f"Train {train_id} delayed {delay_seconds//60} min (halted in place).",
+                        "debug": debug_note}, 200
+
+    def respond_to_decision(self, train_id, decision):
+        """Apply the controller's accept/reject on a train's proposed plan.
+        Returns (payload, http_status)."""
+        with self.lock:
+            train = self.trains.get(train_id)
+            if not train or not train.proposed_plan:
+                return {"success": False, "message": "Train or plan not found."}, 404
+
+            if decision == 'accept':
+                print(f"--- User ACCEPTED plan for {train.name}. Executing... ---")
+                self.log_decision(f"Controller ACCEPTED plan for {train.name}")
+                plan = train.proposed_plan
+                action = plan.get("action")
+
+                train.halted_by = plan.get("caused_by")
+
+                if action == "MOVE_TO_LOOP_AND_HALT":
+                    train.status = "EN_ROUTE_TO_LOOP"
+                    train.maneuver_target_km = plan.get("location_km")
+                elif action == "HALT":
+                    train.status = "HALTED"
+                    train.speed_kmh = 0
+
+            elif decision == 'reject':
+                print(f"--- User REJECTED plan for {train.name}. Resuming normal operation. ---")
+                self.log_decision(f"Controller REJECTED plan for {train.name}")
+                train.status = "ON_SCHEDULE"
+                if train.halted_by:
+                    conflict_id = f"{train.halted_by}-{train.id}"
+                    if conflict_id in self.conflicts_handled:
+                        self.conflicts_handled.remove(conflict_id)
+                    train.halted_by = None
+
+            train.proposed_plan = None
+            self.publish_state()
+        return {"success": True}, 200
+
     def load_schedule_from_db(self):
         conn = sqlite3.connect(DATABASE_FILE)
         conn.row_factory = sqlite3.Row
@@ -209,6 +364,7 @@ class Simulation:
                 train_to_wait.proposed_plan = plan
                 train_to_wait.status = "AWAITING_DECISION"
                 train_to_wait.halted_by = plan.get("caused_by")   # ✅ ensure explain works
+                self.publish_state()
         except Exception as e:
             error_msg = f"ERROR in AI resolution: {e}"
             print(f"!!! {error_msg} !!!")
@@ -313,6 +469,7 @@ class Simulation:
                 self.check_for_resolved_conflicts()
                 self.detect_conflicts()
                 print(self.get_state_string())
+                self.publish_state()
             time.sleep(1)
 
     def get_formatted_time(self):
@@ -331,9 +488,20 @@ class Simulation:
                 state_str += f"\n  > {train.name} ({train.id}): Pos={train.position_km:.2f} km, Status={train.status}"
         return state_str
 
-    def get_simulation_state_for_api(self):
+    def get_simulation_state_for_api(self, fields=None, statuses=None, min_km=None, max_km=None):
+        """Snapshot the trains for the API, optionally projected to `fields` and
+        filtered by status and position range."""
         with self.lock:
+            trains = []
+            for train in self.trains.values():
+                if statuses and train.status not in statuses:
+                    continue
+                if min_km is not None and train.position_km < min_km:
+                    continue
+                if max_km is not None and train.position_km > max_km:
+                    continue
+                trains.append(train.to_dict(fields))
             return {
                 "simulation_time": self.get_formatted_time(),
-                "trains": [train.to_dict() for train in self.trains.values()]
+                "trains": trains
             }